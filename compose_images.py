@@ -4,38 +4,53 @@ Adds object images to background images and generates labelme annotations.
 """
 
 import os
-import json
 import base64
-import random
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from io import BytesIO
 
+import numpy as np
+import orjson
 import yaml
 from PIL import Image
 
+try:
+    # libyaml-backed loader is much faster than the pure-Python one
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 
 def load_config(config_path: str = "config.yaml") -> dict:
     """Load configuration from YAML file."""
     with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
 
 
 def get_image_files(directory: str, extensions: tuple = (".jpg", ".jpeg", ".png")) -> list:
-    """Get all image files from a directory."""
-    if not os.path.exists(directory):
+    """
+    Get all image files from a directory, sorted by path.
+    Random draws index into these lists, so a stable order is what makes a
+    fixed `random_seed` reproducible across filesystems and directory copies.
+    """
+    if not os.path.isdir(directory):
         raise FileNotFoundError(f"Directory not found: {directory}")
     
-    files = []
-    for f in os.listdir(directory):
-        if f.lower().endswith(extensions):
-            files.append(os.path.join(directory, f))
-    return files
+    # scandir entries carry the file type, so no per-file stat is needed
+    with os.scandir(directory) as entries:
+        return sorted(
+            entry.path for entry in entries
+            if entry.name.lower().endswith(extensions) and entry.is_file()
+        )
 
 
 def crop_and_resize_to_target(image: Image.Image, target_width: int, target_height: int) -> Image.Image:
     """
     Crop and resize image to target resolution while preserving aspect ratio.
-    If the aspect ratio doesn't match, crop the center portion first, then resize.
+    If the aspect ratio doesn't match, the center portion is cropped; the crop is
+    fused into the resize via `box` so no intermediate cropped image is allocated.
     """
     target_ratio = target_width / target_height
     img_width, img_height = image.size
@@ -43,41 +58,71 @@ def crop_and_resize_to_target(image: Image.Image, target_width: int, target_heig
     
     if abs(img_ratio - target_ratio) < 0.001:
         # Aspect ratio matches, just resize
-        return image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-    
-    # Need to crop first
-    if img_ratio > target_ratio:
+        box = (0, 0, img_width, img_height)
+    elif img_ratio > target_ratio:
         # Image is wider, crop width
         new_width = int(img_height * target_ratio)
         left = (img_width - new_width) // 2
-        image = image.crop((left, 0, left + new_width, img_height))
+        box = (left, 0, left + new_width, img_height)
     else:
         # Image is taller, crop height
         new_height = int(img_width / target_ratio)
         top = (img_height - new_height) // 2
-        image = image.crop((0, top, img_width, top + new_height))
+        box = (0, top, img_width, top + new_height)
     
-    # Now resize to target
-    return image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+    return image.resize((target_width, target_height), Image.Resampling.LANCZOS, box=box)
 
 
 def resize_object_with_height(obj_image: Image.Image, target_height: int) -> Image.Image:
     """
     Resize object image to target height while preserving aspect ratio.
+    Uses BICUBIC: after alpha blending it is visually indistinguishable from
+    LANCZOS on these small objects and considerably cheaper.
     """
     obj_width, obj_height = obj_image.size
     ratio = target_height / obj_height
     new_width = int(obj_width * ratio)
-    return obj_image.resize((new_width, target_height), Image.Resampling.LANCZOS)
+    return obj_image.resize((new_width, target_height), Image.Resampling.BICUBIC)
+
+
+@functools.lru_cache(maxsize=None)
+def load_object(obj_path: str) -> Image.Image:
+    """
+    Decode an object PNG once per process and keep it in memory as RGBA.
+    The returned image is shared and must not be modified.
+    """
+    with Image.open(obj_path) as obj_image:
+        return obj_image.convert("RGBA")
+
+
+@functools.lru_cache(maxsize=1024)
+def resize_object_cached(obj_path: str, target_height: int) -> np.ndarray:
+    """
+    Resize a cached object to target height and return it as an RGBA uint8 array
+    ready for blending. Heights come from a bounded integer range, so repeated
+    (object, height) pairs across backgrounds hit the cache. The returned array
+    is shared and read-only.
+    """
+    obj_arr = np.asarray(resize_object_with_height(load_object(obj_path), target_height))
+    obj_arr.setflags(write=False)
+    return obj_arr
+
+
+def preload_objects(object_files: list):
+    """Worker initializer: eagerly decode the whole object bank."""
+    for obj_path in object_files:
+        load_object(obj_path)
 
 
-def calculate_valid_position(obj_width: int, obj_height: int, config: dict) -> tuple:
+def calculate_valid_positions(obj_widths: np.ndarray, obj_heights: np.ndarray, config: dict, rng: np.random.Generator) -> tuple:
     """
-    Calculate a valid (x, y) position for the object center.
+    Calculate valid (x, y) positions for a batch of object centers.
     Constraints:
     - object_x_min <= center_x <= object_x_max
     - object_y_min <= center_y <= object_y_max
     - Object must fit within the image bounds (1280x720)
+    All positions are drawn from `rng` in one vectorized call per axis.
+    Returns (centers_x, centers_y) arrays.
     """
     output_width = config["output_width"]
     output_height = config["output_height"]
@@ -88,72 +133,69 @@ def calculate_valid_position(obj_width: int, obj_height: int, config: dict) -> t
     
     # Calculate valid range for center position
     # Object must fit within image bounds
-    half_width = obj_width // 2
-    half_height = obj_height // 2
+    half_widths = obj_widths // 2
+    half_heights = obj_heights // 2
     
     # Adjust x range to ensure object fits
-    valid_x_min = max(x_min, half_width)
-    valid_x_max = min(x_max, output_width - half_width)
+    valid_x_min = np.maximum(x_min, half_widths)
+    valid_x_max = np.minimum(x_max, output_width - half_widths)
     
     # Adjust y range to ensure object fits
-    valid_y_min = max(y_min, half_height)
-    valid_y_max = min(y_max, output_height - half_height)
+    valid_y_min = np.maximum(y_min, half_heights)
+    valid_y_max = np.minimum(y_max, output_height - half_heights)
     
-    if valid_x_min > valid_x_max or valid_y_min > valid_y_max:
-        # Fallback: place at center of valid area
-        center_x = (x_min + x_max) // 2
-        center_y = (y_min + y_max) // 2
-        return center_x, center_y
+    valid = (valid_x_min <= valid_x_max) & (valid_y_min <= valid_y_max)
     
-    center_x = random.randint(valid_x_min, valid_x_max)
-    center_y = random.randint(valid_y_min, valid_y_max)
+    # Objects without a valid range draw from a placeholder range and are replaced below
+    centers_x = rng.integers(valid_x_min, np.where(valid, valid_x_max, valid_x_min), endpoint=True)
+    centers_y = rng.integers(valid_y_min, np.where(valid, valid_y_max, valid_y_min), endpoint=True)
     
-    return center_x, center_y
+    # Fallback: place at center of valid area
+    centers_x = np.where(valid, centers_x, (x_min + x_max) // 2)
+    centers_y = np.where(valid, centers_y, (y_min + y_max) // 2)
+    
+    return centers_x, centers_y
 
 
-def composite_images(background: Image.Image, obj_image: Image.Image, center_x: int, center_y: int) -> Image.Image:
+def composite_images(canvas: np.ndarray, obj_arr: np.ndarray, center_x: int, center_y: int) -> np.ndarray:
     """
-    Composite object image onto background at the specified center position.
+    Composite object onto canvas at the specified center position, in place.
+    `canvas` is an RGB uint8 array (typically a copy of the background) and
+    `obj_arr` an RGBA uint8 array. Only the object's bounding box is touched.
     """
-    # Ensure background is in RGBA mode for compositing
-    if background.mode != "RGBA":
-        background = background.convert("RGBA")
-    
-    # Ensure object has alpha channel
-    if obj_image.mode != "RGBA":
-        obj_image = obj_image.convert("RGBA")
-    
-    obj_width, obj_height = obj_image.size
+    obj_height, obj_width = obj_arr.shape[:2]
+    bg_height, bg_width = canvas.shape[:2]
     
     # Calculate top-left position from center
     left = center_x - obj_width // 2
     top = center_y - obj_height // 2
     
-    # Create a copy of background to paste onto
-    result = background.copy()
+    # Clip the object box to the canvas bounds
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + obj_width, bg_width), min(top + obj_height, bg_height)
     
-    # Paste object with alpha mask
-    result.paste(obj_image, (left, top), obj_image)
+    if x0 >= x1 or y0 >= y1:
+        return canvas
     
-    # Convert back to RGB for output
-    return result.convert("RGB")
-
-
-def generate_random_filename(prefix: str, digits: int = 8) -> str:
-    """Generate a random filename with prefix and random digits."""
-    max_num = 10 ** digits - 1
-    random_num = random.randint(0, max_num)
-    return f"{prefix}-{random_num:0{digits}d}"
+    obj_arr = obj_arr[y0 - top:y1 - top, x0 - left:x1 - left]
+    region = canvas[y0:y1, x0:x1]
+    
+    # Blend with integer arithmetic: (obj * a + bg * (255 - a) + 127) // 255
+    alpha = obj_arr[..., 3:4].astype(np.uint16)
+    region[:] = (
+        (obj_arr[..., :3].astype(np.uint16) * alpha + region.astype(np.uint16) * (255 - alpha) + 127) // 255
+    ).astype(np.uint8)
+    
+    return canvas
 
 
-def image_to_base64(image: Image.Image, format: str = "JPEG", quality: int = 95) -> str:
-    """Convert PIL Image to base64 string."""
-    buffer = BytesIO()
-    if format.upper() == "JPEG":
-        image.save(buffer, format="JPEG", quality=quality)
-    else:
-        image.save(buffer, format=format)
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+def generate_filename(prefix: str, counter: int, image_bytes: bytes) -> str:
+    """
+    Generate an output filename from a run counter and a short content hash.
+    The counter makes names unique within a run; the hash makes identical
+    outputs from a re-run with the same seed map to the same name.
+    """
+    return f"{prefix}-{counter:08d}-{hashlib.blake2b(image_bytes, digest_size=4).hexdigest()}"
 
 
 def create_labelme_json(
@@ -163,12 +205,11 @@ def create_labelme_json(
     bbox_left: float,
     bbox_top: float,
     bbox_right: float,
-    bbox_bottom: float,
-    image_format: str = "JPEG",
-    jpg_quality: int = 95
+    bbox_bottom: float
 ) -> dict:
     """
     Create labelme format JSON annotation.
+    imageData is left as null; write_labelme_json streams it in when embedding is enabled.
     """
     return {
         "version": "5.5.0",
@@ -188,12 +229,220 @@ def create_labelme_json(
             }
         ],
         "imagePath": image_filename,
-        "imageData": image_to_base64(image, format=image_format, quality=jpg_quality),
+        "imageData": None,
         "imageHeight": image.height,
         "imageWidth": image.width
     }
 
 
+def write_labelme_json(output_json_path: str, labelme_data: dict, image_bytes: bytes = None, chunk_size: int = 3 * 16384):
+    """
+    Write labelme JSON with `image_bytes` base64-encoded as imageData.
+    The base64 text is streamed to the file in chunks rather than built as one
+    string, keeping peak memory at one chunk. Serialization uses orjson with
+    2-space indentation.
+    If `image_bytes` is None, imageData is written as null and labelme loads
+    the image from imagePath instead.
+    """
+    if image_bytes is None:
+        with open(output_json_path, "wb") as f:
+            f.write(orjson.dumps(labelme_data, option=orjson.OPT_INDENT_2))
+        return
+    
+    # Serialize everything else around a placeholder, then splice imageData in
+    placeholder = "\0imageData\0"
+    head, tail = orjson.dumps(
+        {**labelme_data, "imageData": placeholder}, option=orjson.OPT_INDENT_2
+    ).split(orjson.dumps(placeholder))
+    
+    # chunk_size is a multiple of 3 so chunks encode without intermediate padding
+    data = memoryview(image_bytes)
+    with open(output_json_path, "wb") as f:
+        f.write(head)
+        f.write(b'"')
+        for start in range(0, len(data), chunk_size):
+            f.write(base64.b64encode(data[start:start + chunk_size]))
+        f.write(b'"')
+        f.write(tail)
+
+
+def generate_batch(
+    background: np.ndarray,
+    obj_paths: list,
+    first_index: int,
+    config: dict,
+    seed: np.random.SeedSequence
+) -> list:
+    """
+    Generate a batch of composites on one background and their labelme annotations.
+    Runs in a worker process; all randomness comes from `seed` so results are
+    reproducible and independent of which worker picks up the task.
+    The batch is composited in place in a single (N, H, W, 3) buffer filled from
+    the shared background, instead of N separate background copies.
+    Outputs are numbered from `first_index`.
+    Returns a list of (output_name, image_bytes, labelme_data), one per object.
+    """
+    rng = np.random.default_rng(seed)
+    min_height = config["min_object_height"]
+    max_height = config["max_object_height"]
+    output_format = config.get("output_format", "jpg").lower()
+    jpg_quality = config.get("output_jpg_quality", 95)
+    pil_format = "JPEG" if output_format == "jpg" else "PNG"
+    image_ext = ".jpg" if output_format == "jpg" else ".png"
+    output_prefix = config.get("output_prefix", "gen")
+    # imagePath is relative path from json directory to image
+    relative_image_prefix = "../images/"
+    
+    # Resize objects to random heights within range, drawn for the whole batch at once
+    target_obj_heights = rng.integers(min_height, max_height, size=len(obj_paths), endpoint=True)
+    obj_arrs = [
+        resize_object_cached(obj_path, int(target_obj_height))
+        for obj_path, target_obj_height in zip(obj_paths, target_obj_heights)
+    ]
+    obj_heights = np.array([obj_arr.shape[0] for obj_arr in obj_arrs])
+    obj_widths = np.array([obj_arr.shape[1] for obj_arr in obj_arrs])
+    
+    # Calculate valid positions
+    centers_x, centers_y = calculate_valid_positions(obj_widths, obj_heights, config, rng)
+    
+    # Calculate bounding boxes
+    bbox_lefts = centers_x - obj_widths // 2
+    bbox_tops = centers_y - obj_heights // 2
+    bbox_rights = bbox_lefts + obj_widths
+    bbox_bottoms = bbox_tops + obj_heights
+    
+    canvases = np.broadcast_to(background, (len(obj_paths),) + background.shape).copy()
+    results = []
+    
+    for i, (canvas, obj_arr) in enumerate(zip(canvases, obj_arrs)):
+        # Composite images
+        result = Image.fromarray(composite_images(canvas, obj_arr, int(centers_x[i]), int(centers_y[i])))
+        
+        # Encode output image once; the same bytes are written to disk and embedded in the JSON
+        buffer = BytesIO()
+        if pil_format == "JPEG":
+            # These match Pillow's current defaults (4:2:0, baseline, no Huffman
+            # optimization); they are pinned so output doesn't change if the defaults do
+            result.save(buffer, pil_format, quality=jpg_quality, subsampling=2, optimize=False, progressive=False)
+        else:
+            result.save(buffer, pil_format)
+        image_bytes = buffer.getvalue()
+        
+        output_name = generate_filename(output_prefix, first_index + i, image_bytes)
+        
+        labelme_data = create_labelme_json(
+            result,
+            relative_image_prefix + output_name + image_ext,
+            config["object_label"],
+            float(bbox_lefts[i]),
+            float(bbox_tops[i]),
+            float(bbox_rights[i]),
+            float(bbox_bottoms[i])
+        )
+        results.append((output_name, image_bytes, labelme_data))
+    
+    return results
+
+
+def write_atomically(path: str, write):
+    """
+    Call `write(temp_path)`, then rename the temporary file to `path`, so an
+    interrupted write never leaves a truncated file under the final name.
+    The temporary file is removed if writing fails.
+    """
+    temp_path = path + ".tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def remove_temp_files(directory: str):
+    """Remove `.tmp` files left behind by a previous run that was killed mid-write."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".tmp") and entry.is_file():
+                os.remove(entry.path)
+
+
+def write_outputs(
+    image_bytes: bytes,
+    output_image_path: str,
+    labelme_data: dict,
+    output_json_path: str,
+    embed_image_data: bool = False
+) -> bool:
+    """
+    Write a finished composite and its labelme JSON to disk.
+    Filenames include a content hash, so an existing image is already identical
+    and is not rewritten. The JSON is always rewritten, since the annotation
+    depends on settings (label, embed_image_data) that the hash doesn't cover.
+    Returns True if the image was written, False if it already existed.
+    """
+    # Save output image
+    image_written = not os.path.exists(output_image_path)
+    if image_written:
+        def write_image(path):
+            with open(path, "wb") as f:
+                f.write(image_bytes)
+        write_atomically(output_image_path, write_image)
+    
+    # Save labelme JSON
+    write_atomically(
+        output_json_path,
+        lambda path: write_labelme_json(path, labelme_data, image_bytes if embed_image_data else None)
+    )
+    return image_written
+
+
+def save_completed(
+    pending: dict,
+    writer: ThreadPoolExecutor,
+    image_prefix: str,
+    json_prefix: str,
+    image_ext: str,
+    embed_image_data: bool = False
+) -> list:
+    """
+    Wait for at least one pending batch and hand its outputs to the writer threads.
+    `pending` maps futures to (background name, object names in that batch).
+    Output paths are `image_prefix + name + image_ext` and `json_prefix + name + ".json"`.
+    Returns the futures of the submitted writes.
+    """
+    writes = []
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        bg_name, obj_names = pending.pop(future)
+        for obj_name, (output_name, image_bytes, labelme_data) in zip(obj_names, future.result()):
+            output_image_path = image_prefix + output_name + image_ext
+            output_json_path = json_prefix + output_name + ".json"
+            writes.append(writer.submit(
+                write_outputs, image_bytes, output_image_path, labelme_data, output_json_path, embed_image_data
+            ))
+            
+            (bbox_left, bbox_top), (bbox_right, bbox_bottom) = labelme_data["shapes"][0]["points"]
+            obj_height = int(bbox_bottom - bbox_top)
+            center_x = int(bbox_left) + int(bbox_right - bbox_left) // 2
+            center_y = int(bbox_top) + obj_height // 2
+            print(f"  Generated: {output_name}{image_ext} (background: {bg_name}, object: {obj_name}, "
+                  f"center: ({center_x}, {center_y}), height: {obj_height}px)")
+    return writes
+
+
+def drain_writes(writes: list) -> tuple:
+    """
+    Wait for queued writes, re-raising any I/O error.
+    Returns (written, skipped) counts.
+    """
+    written = sum(write.result() for write in writes)
+    skipped = len(writes) - written
+    writes.clear()
+    return written, skipped
+
+
 def main():
     # Load configuration
     config = load_config()
@@ -209,6 +458,8 @@ def main():
     output_json_dir = os.path.join(height_range_dir, "json")
     os.makedirs(output_images_dir, exist_ok=True)
     os.makedirs(output_json_dir, exist_ok=True)
+    remove_temp_files(output_images_dir)
+    remove_temp_files(output_json_dir)
     
     # Get background and object images
     background_files = get_image_files(
@@ -234,94 +485,86 @@ def main():
     duplicate_count = config["background_duplicate_count"]
     target_width = config["output_width"]
     target_height = config["output_height"]
-    label = config["object_label"]
-    output_prefix = config.get("output_prefix", "gen")
     output_format = config.get("output_format", "jpg").lower()
-    jpg_quality = config.get("output_jpg_quality", 95)
+    embed_image_data = config.get("embed_image_data", False)
     
-    # Determine image format settings
-    if output_format == "jpg":
-        image_ext = ".jpg"
-        pil_format = "JPEG"
-    else:
-        image_ext = ".png"
-        pil_format = "PNG"
+    # Output paths are built by concatenation in the hot loop, so prefixes are precomputed
+    image_ext = ".jpg" if output_format == "jpg" else ".png"
+    image_prefix = output_images_dir + os.sep
+    json_prefix = output_json_dir + os.sep
+    
+    # Per-task seeds are spawned from a master seed so a fixed `random_seed`
+    # reproduces the whole run regardless of worker scheduling
+    master_seed = np.random.SeedSequence(config.get("random_seed"))
+    master_rng = np.random.default_rng(master_seed)
+    num_workers = config.get("num_workers") or os.cpu_count()
+    batch_size = config.get("batch_size", 8)
+    # Bound queued tasks so prepared backgrounds don't pile up in memory
+    max_pending = num_workers * 4
     
     total_generated = 0
+    total_skipped = 0
+    # Output files are numbered in submission order
+    counter = 0
     
-    for bg_path in background_files:
-        bg_name = Path(bg_path).stem
-        print(f"\nProcessing background: {bg_name}")
+    # Disk writes run on threads (file I/O releases the GIL) so the parent can keep
+    # preparing backgrounds and submitting work while outputs are flushed
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=preload_objects,
+        initargs=(object_files,)
+    ) as executor, ThreadPoolExecutor(max_workers=4) as writer:
+        pending = {}
+        writes = []
         
-        # Load and prepare background
-        background = Image.open(bg_path)
-        background = crop_and_resize_to_target(background, target_width, target_height)
-        
-        # Select random object images for this background
-        selected_objects = random.choices(object_files, k=duplicate_count)
-        
-        for i, obj_path in enumerate(selected_objects):
-            obj_name = Path(obj_path).stem
-            
-            # Load object image
-            obj_image = Image.open(obj_path)
-            
-            # Resize object to random height within range
-            target_obj_height = random.randint(min_height, max_height)
-            obj_resized = resize_object_with_height(obj_image, target_obj_height)
-            
-            # Calculate valid position
-            center_x, center_y = calculate_valid_position(
-                obj_resized.width, obj_resized.height, config
-            )
+        for bg_path in background_files:
+            # Batches finish out of order, so each output is logged with its background
+            bg_name = Path(bg_path).stem
             
-            # Composite images
-            result = composite_images(background.copy(), obj_resized, center_x, center_y)
+            # Load and prepare background once; workers receive the prepared RGB pixels.
+            # The background never needs alpha, so it is kept in RGB throughout and
+            # only converted when the source isn't RGB already (JPEGs skip the copy)
+            background = Image.open(bg_path)
+            if background.mode != "RGB":
+                background = background.convert("RGB")
+            background = crop_and_resize_to_target(background, target_width, target_height)
+            background = np.asarray(background)
             
-            # Calculate bounding box
-            obj_width, obj_height = obj_resized.size
-            bbox_left = center_x - obj_width // 2
-            bbox_top = center_y - obj_height // 2
-            bbox_right = bbox_left + obj_width
-            bbox_bottom = bbox_top + obj_height
+            # Select random object images for this background
+            selected_objects = [object_files[i] for i in master_rng.integers(len(object_files), size=duplicate_count)]
             
-            # Generate output filename with random 8-digit number
-            output_name = generate_random_filename(output_prefix, digits=8)
-            output_image_filename = f"{output_name}{image_ext}"
-            output_image_path = os.path.join(output_images_dir, output_image_filename)
-            output_json_path = os.path.join(output_json_dir, f"{output_name}.json")
+            # Submit the duplicates in batches that share one background buffer
+            for start in range(0, duplicate_count, batch_size):
+                batch_objects = selected_objects[start:start + batch_size]
+                future = executor.submit(
+                    generate_batch,
+                    background,
+                    batch_objects,
+                    counter,
+                    config,
+                    master_seed.spawn(1)[0]
+                )
+                pending[future] = (bg_name, [Path(obj_path).stem for obj_path in batch_objects])
+                counter += len(batch_objects)
+                
+                if len(pending) >= max_pending:
+                    writes += save_completed(pending, writer, image_prefix, json_prefix, image_ext, embed_image_data)
             
-            # Save output image
-            if pil_format == "JPEG":
-                result.save(output_image_path, pil_format, quality=jpg_quality)
-            else:
-                result.save(output_image_path, pil_format)
-            
-            # Create and save labelme JSON
-            # imagePath is relative path from json directory to image
-            relative_image_path = f"../images/{output_image_filename}"
-            labelme_data = create_labelme_json(
-                result,
-                relative_image_path,
-                label,
-                float(bbox_left),
-                float(bbox_top),
-                float(bbox_right),
-                float(bbox_bottom),
-                image_format=pil_format,
-                jpg_quality=jpg_quality
-            )
-            
-            with open(output_json_path, "w", encoding="utf-8") as f:
-                json.dump(labelme_data, f, indent=2)
-            
-            print(f"  Generated: {output_image_filename} (object: {obj_name}, "
-                  f"center: ({center_x}, {center_y}), height: {target_obj_height}px)")
-            
-            total_generated += 1
+            # Drain queued writes so encoded outputs don't accumulate in memory
+            written, skipped = drain_writes(writes)
+            total_generated += written
+            total_skipped += skipped
+        
+        while pending:
+            writes += save_completed(pending, writer, image_prefix, json_prefix, image_ext, embed_image_data)
+        written, skipped = drain_writes(writes)
+        total_generated += written
+        total_skipped += skipped
     
     print(f"\n{'='*50}")
     print(f"Total images generated: {total_generated}")
+    if total_skipped:
+        print(f"Kept {total_skipped} identical existing images (annotations rewritten)")
     print(f"Output directory: {height_range_dir}")
     print(f"  Images: {output_images_dir}")
     print(f"  JSON: {output_json_dir}")
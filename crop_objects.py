@@ -4,16 +4,23 @@ Crops object images to remove transparent padding, keeping only the actual objec
 """
 
 import os
+import json
 from pathlib import Path
 
 import yaml
 from PIL import Image
 
+try:
+    # libyaml-backed loader is much faster than the pure-Python one
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 
 def load_config(config_path: str = "config.yaml") -> dict:
     """Load configuration from YAML file."""
     with open(config_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
 
 
 def crop_to_content(image: Image.Image, padding: int = 0) -> Image.Image:
@@ -27,15 +34,17 @@ def crop_to_content(image: Image.Image, padding: int = 0) -> Image.Image:
     Returns:
         Cropped image containing only the non-transparent region (plus optional padding)
     """
-    # Ensure image has alpha channel
-    if image.mode != "RGBA":
+    # Modes with an alpha band are read as-is; only convert when transparency
+    # is stored outside the pixel data (e.g. palette tRNS)
+    if image.mode not in ("RGBA", "RGBa", "LA", "La", "PA"):
+        if "transparency" not in image.info:
+            # No alpha at all, so the whole image is content
+            return image
         image = image.convert("RGBA")
     
-    # Get the alpha channel
-    alpha = image.split()[3]
-    
-    # Get bounding box of non-transparent pixels
-    bbox = alpha.getbbox()
+    # Get bounding box of non-transparent pixels. Alpha is the last band ("A", or
+    # "a" for premultiplied modes); getchannel copies only that plane
+    bbox = image.getchannel(image.getbands()[-1]).getbbox()
     
     if bbox is None:
         # Image is fully transparent, return as-is
@@ -59,14 +68,50 @@ def crop_to_content(image: Image.Image, padding: int = 0) -> Image.Image:
 
 def get_image_files(directory: str, extensions: tuple = (".png",)) -> list:
     """Get all image files from a directory."""
-    if not os.path.exists(directory):
+    if not os.path.isdir(directory):
         raise FileNotFoundError(f"Directory not found: {directory}")
     
-    files = []
-    for f in os.listdir(directory):
-        if f.lower().endswith(extensions):
-            files.append(os.path.join(directory, f))
-    return files
+    # scandir entries carry the file type, so no per-file stat is needed
+    with os.scandir(directory) as entries:
+        return [
+            entry.path for entry in entries
+            if entry.name.lower().endswith(extensions) and entry.is_file()
+        ]
+
+
+def load_crop_cache(cache_path: str) -> dict:
+    """
+    Load the sidecar cache of previously processed files.
+    Maps filename -> {"mtime_ns", "padding"}. Malformed entries are dropped.
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        # A corrupt cache only costs a full re-run
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return {
+        filename: entry for filename, entry in cache.items()
+        if isinstance(entry, dict)
+        and isinstance(entry.get("mtime_ns"), int)
+        and isinstance(entry.get("padding"), int)
+    }
+
+
+def save_crop_cache(cache_path: str, cache: dict):
+    """
+    Save the sidecar cache of processed files.
+    Written to a temporary file and renamed into place, so an interrupted save
+    never leaves a truncated cache behind.
+    """
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(temp_path, cache_path)
 
 
 def main():
@@ -98,33 +143,63 @@ def main():
     print(f"Padding: {padding}px")
     print("-" * 50)
     
-    processed = 0
+    # Files unchanged since the last run (same mtime and padding) are skipped
+    # without being opened or decoded
+    cache_path = os.path.join(output_dir, ".cache.json")
+    cache = load_crop_cache(cache_path)
     
-    for obj_path in object_files:
-        filename = Path(obj_path).name
-        
-        # Load image
-        image = Image.open(obj_path)
-        original_size = image.size
-        
-        # Crop to content
-        cropped = crop_to_content(image, padding=padding)
-        new_size = cropped.size
-        
-        # Calculate size reduction
-        original_pixels = original_size[0] * original_size[1]
-        new_pixels = new_size[0] * new_size[1]
-        reduction = (1 - new_pixels / original_pixels) * 100 if original_pixels > 0 else 0
-        
-        # Save
-        output_path = os.path.join(output_dir, filename)
-        cropped.save(output_path, "PNG")
-        
-        print(f"  {filename}: {original_size[0]}x{original_size[1]} -> {new_size[0]}x{new_size[1]} ({reduction:.1f}% smaller)")
-        processed += 1
+    processed = 0
+    skipped = 0
+    
+    # Save the cache even if the run is interrupted, so finished files stay skipped
+    try:
+        for obj_path in object_files:
+            filename = Path(obj_path).name
+            output_path = os.path.join(output_dir, filename)
+            
+            entry = cache.get(filename)
+            if (
+                entry is not None
+                and entry["mtime_ns"] == os.stat(obj_path).st_mtime_ns
+                and entry["padding"] == padding
+                and os.path.exists(output_path)
+            ):
+                skipped += 1
+                continue
+            
+            # Load image (header only; pixels are decoded on first access)
+            image = Image.open(obj_path)
+            original_size = image.size
+            
+            # Crop to content
+            cropped = crop_to_content(image, padding=padding)
+            new_size = cropped.size
+            already_cropped = new_size == original_size
+            
+            # Calculate size reduction
+            original_pixels = original_size[0] * original_size[1]
+            new_pixels = new_size[0] * new_size[1]
+            reduction = (1 - new_pixels / original_pixels) * 100 if original_pixels > 0 else 0
+            
+            # Save (an already-tight file being overwritten in place is left untouched)
+            if not (overwrite and already_cropped):
+                cropped.save(output_path, "PNG")
+            
+            # Record the input's mtime after saving, since overwrite mode rewrites it
+            cache[filename] = {
+                "mtime_ns": os.stat(obj_path).st_mtime_ns,
+                "padding": padding
+            }
+            
+            print(f"  {filename}: {original_size[0]}x{original_size[1]} -> {new_size[0]}x{new_size[1]} ({reduction:.1f}% smaller)")
+            processed += 1
+    finally:
+        save_crop_cache(cache_path, cache)
     
     print("-" * 50)
     print(f"Processed {processed} images")
+    if skipped:
+        print(f"Skipped {skipped} unchanged images")
     print(f"Output directory: {output_dir}")
 
 